@@ -84,6 +84,23 @@ class Runner:
         )
         return output
 
+    def popen(
+        self, cmd: str, cwd: Optional[str] = None, **kwargs: Any
+    ) -> "subprocess.Popen[str]":
+        """launch the command with a piped stdout to stream the output instead
+        of buffering it whole; the caller is responsible for `wait()`"""
+        if cwd is None:
+            cwd = self.cwd
+        logger.debug("Running command: %s", cmd)
+        return subprocess.Popen(  # pylint:disable=consider-using-with
+            cmd,
+            shell=True,
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            encoding="utf-8",
+            **kwargs,
+        )
+
     @property
     def cwd(self) -> str:
         if self._set_cwd_to_git_root:
@@ -107,9 +124,18 @@ class Runner:
 
 git_runner = Runner(set_cwd_to_git_root=True)
 
+IS_SHALLOW = None  # type: Optional[bool]
+
 
 def is_shallow() -> bool:
-    return git_runner.run("git rev-parse --is-shallow-repository") == "true"
+    # The negative result is cached, since a full repository never becomes
+    # shallow again. The positive one is re-checked every time, because the
+    # repository could be unshallowed by `git fetch --unshallow` in between
+    global IS_SHALLOW
+    if IS_SHALLOW is False:
+        return IS_SHALLOW
+    IS_SHALLOW = git_runner.run("git rev-parse --is-shallow-repository") == "true"
+    return IS_SHALLOW
 
 
 def get_tags() -> List[str]:
@@ -1,14 +1,16 @@
 #!/usr/bin/env python3
 import logging
+import re
+import subprocess
+import sys
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser, ArgumentTypeError
+from functools import cached_property, lru_cache
 from pathlib import Path
 from typing import Any, Dict, Iterable, List, Literal, Optional, Set, Tuple, Union
 
-from git_helper import TWEAK, Git, get_tags, git_runner, removeprefix
+from git_helper import TWEAK, Git, get_tags, git_runner, is_shallow
 
 FILE_WITH_VERSION_PATH = "cmake/autogenerated_versions.txt"
-CHANGELOG_IN_PATH = "debian/changelog.in"
-CHANGELOG_PATH = "debian/changelog"
 GENERATED_CONTRIBUTORS = "src/Storages/System/StorageSystemContributors.generated.cpp"
 
 # It has {{ for plain "{"
@@ -20,19 +22,8 @@ const char * auto_contributors[] {{
 
 VERSIONS = Dict[str, Union[int, str]]
 
-VERSIONS_TEMPLATE = """# This variables autochanged by tests/ci/version_helper.py:
-
-# NOTE: VERSION_REVISION has nothing common with DBMS_TCP_PROTOCOL_VERSION,
-# only DBMS_TCP_PROTOCOL_VERSION should be incremented on protocol changes.
-SET(VERSION_REVISION {revision})
-SET(VERSION_MAJOR {major})
-SET(VERSION_MINOR {minor})
-SET(VERSION_PATCH {patch})
-SET(VERSION_GITHASH {githash})
-SET(VERSION_DESCRIBE {describe})
-SET(VERSION_STRING {string})
-# end of autochange
-"""
+# Lines to parse in FILE_WITH_VERSION_PATH, e.g. `SET(VERSION_MAJOR 24)`
+VERSION_LINE_REGEXP = re.compile(r"\ASET\(VERSION_(\w+)\s+(.+?)\)\s*\Z")
 
 
 class ClickHouseVersion:
@@ -64,13 +55,9 @@ class ClickHouseVersion:
 
     def update(self, part: PART_TYPE) -> "ClickHouseVersion":
         """If part is valid, returns a new version"""
-        if part == "major":
-            return self.major_update()
-        if part == "minor":
-            return self.minor_update()
-        if part == "patch":
-            return self.patch_update()
-        raise KeyError(f"wrong part {part} is used")
+        if part not in self._UPDATERS:
+            raise KeyError(f"wrong part {part} is used")
+        return self._UPDATERS[part](self)
 
     def bump(self) -> "ClickHouseVersion":
         if self.minor < 12:
@@ -83,8 +70,15 @@ class ClickHouseVersion:
             self._revision += 1
             self._patch = 1
             self._tweak = 1
+        self._reset_cache()
         return self
 
+    def _reset_cache(self) -> None:
+        # The instance is mutated, so the memoized cached_property values are
+        # stale and must be recalculated on the next access
+        for cached in ("string", "as_dict", "as_tuple"):
+            self.__dict__.pop(cached, None)
+
     def major_update(self) -> "ClickHouseVersion":
         if self._git is not None:
             self._git.update()
@@ -104,6 +98,13 @@ class ClickHouseVersion:
             self.major, self.minor, self.patch + 1, self.revision, self._git
         )
 
+    # update() dispatch table, must be defined after the methods it refers to
+    _UPDATERS = {
+        "major": major_update,
+        "minor": minor_update,
+        "patch": patch_update,
+    }
+
     def reset_tweak(self) -> "ClickHouseVersion":
         if self._git is not None:
             self._git.update()
@@ -130,6 +131,7 @@ class ClickHouseVersion:
     @tweak.setter
     def tweak(self, tweak: int) -> None:
         self._tweak = tweak
+        self._reset_cache()
 
     @property
     def revision(self) -> int:
@@ -150,8 +152,8 @@ class ClickHouseVersion:
     def description(self) -> str:
         return self._description
 
-    @property
-    def string(self):
+    @cached_property
+    def string(self) -> str:
         return ".".join(
             (str(self.major), str(self.minor), str(self.patch), str(self.tweak))
         )
@@ -166,6 +168,7 @@ class ClickHouseVersion:
             return VersionType.LTS
         return VersionType.STABLE
 
+    @cached_property
     def as_dict(self) -> VERSIONS:
         return {
             "revision": self.revision,
@@ -178,6 +181,7 @@ class ClickHouseVersion:
             "string": self.string,
         }
 
+    @cached_property
     def as_tuple(self) -> Tuple[int, int, int, int]:
         return (self.major, self.minor, self.patch, self.tweak)
 
@@ -186,6 +190,8 @@ class ClickHouseVersion:
             raise ValueError(f"version type {version_type} not in {VersionType.VALID}")
         self._description = version_type
         self._describe = f"v{self.string}-{version_type}"
+        # as_dict includes the changed describe and description fields
+        self.__dict__.pop("as_dict", None)
         return self
 
     def copy(self) -> "ClickHouseVersion":
@@ -260,20 +266,30 @@ def validate_version(version: str) -> None:
         int(part)
 
 
+@lru_cache(maxsize=None)
 def get_abs_path(path: Union[Path, str]) -> Path:
+    # git_runner.cwd memoizes the resolved git root, and the repository does
+    # not move within a process, so the resolved paths are cached as well
     return (Path(git_runner.cwd) / path).absolute()
 
 
 def read_versions(versions_path: Union[Path, str] = FILE_WITH_VERSION_PATH) -> VERSIONS:
+    path = get_abs_path(versions_path)
+    # The modification time is a part of the cache key, so a changed file is
+    # automatically reread. The copy protects the cache from mutating callers
+    return dict(_read_versions_cached(path, path.stat().st_mtime_ns))
+
+
+@lru_cache(maxsize=8)
+def _read_versions_cached(versions_path: Path, mtime_ns: int) -> VERSIONS:
     versions = {}
-    for line in get_abs_path(versions_path).read_text(encoding="utf-8").splitlines():
-        line = line.strip()
-        if not line.startswith("SET("):
+    for line in versions_path.read_text(encoding="utf-8").splitlines():
+        match = VERSION_LINE_REGEXP.match(line.strip())
+        if match is None:
             continue
 
-        value = 0  # type: Union[int, str]
-        name, value = line[4:-1].split(maxsplit=1)
-        name = removeprefix(name, "VERSION_").lower()
+        name = match.group(1).lower()
+        value = match.group(2)  # type: Union[int, str]
         try:
             value = int(value)
         except ValueError:
@@ -329,7 +345,7 @@ def get_version_from_tag(tag: str) -> ClickHouseVersion:
 
 
 def version_arg(version: str) -> ClickHouseVersion:
-    version = removeprefix(version, "refs/tags/")
+    version = version.removeprefix("refs/tags/")
     try:
         return get_version_from_string(version)
     except ValueError:
@@ -391,9 +407,27 @@ def update_cmake_version(
     version: ClickHouseVersion,
     versions_path: Union[Path, str] = FILE_WITH_VERSION_PATH,
 ) -> None:
-    get_abs_path(versions_path).write_text(
-        VERSIONS_TEMPLATE.format_map(version.as_dict()), encoding="utf-8"
-    )
+    content = f"""# This variables autochanged by tests/ci/version_helper.py:
+
+# NOTE: VERSION_REVISION has nothing common with DBMS_TCP_PROTOCOL_VERSION,
+# only DBMS_TCP_PROTOCOL_VERSION should be incremented on protocol changes.
+SET(VERSION_REVISION {version.revision})
+SET(VERSION_MAJOR {version.major})
+SET(VERSION_MINOR {version.minor})
+SET(VERSION_PATCH {version.patch})
+SET(VERSION_GITHASH {version.githash})
+SET(VERSION_DESCRIBE {version.describe})
+SET(VERSION_STRING {version.string})
+# end of autochange
+"""
+    path = get_abs_path(versions_path)
+    try:
+        # A touched file triggers cmake reconfiguration, skip no-op rewrites
+        if path.read_text(encoding="utf-8") == content:
+            return
+    except FileNotFoundError:
+        pass
+    path.write_text(content, encoding="utf-8")
 
 
 def update_contributors(
@@ -403,25 +437,45 @@ def update_contributors(
 ) -> None:
     # Check if we have shallow checkout by comparing number of lines
     # '--is-shallow-repository' is in git since 2.15, 2017-10-30
-    if git_runner.run("git rev-parse --is-shallow-repository") == "true" and not force:
+    if is_shallow() and not force:
         logging.warning("The repository is shallow, refusing to update contributors")
         if raise_error:
             raise RuntimeError("update_contributors executed on a shallow repository")
         return
 
     # format: "  1016  Alexey Arno"
-    shortlog = git_runner.run("git shortlog HEAD --summary")
+    # Stream the output instead of buffering the whole shortlog, so the
+    # parsing overlaps with git producing the list
+    proc = git_runner.popen("git shortlog HEAD --summary")
     escaping = str.maketrans({"\\": "\\\\", '"': '\\"'})
-    contributors = sorted(
-        [c.split(maxsplit=1)[-1].translate(escaping) for c in shortlog.split("\n")],
+    assert proc.stdout is not None
+    # Sort the raw names, not the wrapped lines, to keep the order of the
+    # committed file
+    contributors = "\n".join(
+        f'    "{c}",'
+        for c in sorted(
+            line.split(maxsplit=1)[-1].rstrip().translate(escaping)
+            for line in proc.stdout
+            if line.strip()
+        )
     )
-    contributors = [f'    "{c}",' for c in contributors]
+    if proc.wait():
+        raise subprocess.CalledProcessError(proc.returncode, proc.args)
 
     executer = Path(__file__).relative_to(git_runner.cwd)
-    content = CONTRIBUTORS_TEMPLATE.format(
-        executer=executer, contributors="\n".join(contributors)
-    )
-    get_abs_path(relative_contributors_path).write_text(content, encoding="utf-8")
+    content = CONTRIBUTORS_TEMPLATE.format(executer=executer, contributors=contributors)
+    # The content is fully formed, so encode it once and write it in a single
+    # syscall instead of flushing it through the default 8 KiB text buffer
+    data = content.encode("utf-8")
+    contributors_path = get_abs_path(relative_contributors_path)
+    try:
+        # Rewriting the same bytes would only bump the mtime and cause an
+        # unnecessary rebuild of the file
+        if contributors_path.read_bytes() == data:
+            return
+    except FileNotFoundError:
+        pass
+    contributors_path.write_bytes(data)
 
 
 def update_version_local(version, version_type="testing"):
@@ -491,11 +545,14 @@ def main():
     if args.update_part or args.update_cmake:
         update_cmake_version(version)
 
-    for k, v in version.as_dict().items():
+    lines = []
+    for k, v in version.as_dict.items():
         name = f"CLICKHOUSE_VERSION_{k.upper()}"
-        print(f"{name}='{v}'")
+        lines.append(f"{name}='{v}'")
         if args.export:
-            print(f"export {name}")
+            lines.append(f"export {name}")
+    # The output is sourced by bash scripts, write it in one piece
+    sys.stdout.write("\n".join(lines) + "\n")
 
 
 if __name__ == "__main__":